@@ -0,0 +1,283 @@
+"""
+=====================================================
+Proyecto TFG – Sistema de Control de Acceso Facial
+Generador de carga extremo a extremo
+Autor: Francisco
+
+Descripción:
+  - Simula N dispositivos ESP32 que:
+      * envían frames JPEG por WebSocket (/ws/stream),
+      * envían imágenes a /upload-image y resultados a /recognition-result/.
+  - Simula M visores móviles conectados a /ws/stream.
+  - Simula la app enviando comandos (/send-command), que el servidor reenvía a
+    un stub local que sustituye al endpoint HTTP /send-command del ESP32.
+  - Informa de throughput, latencias p50/p99, FPS por visor y tasa de errores.
+
+Uso:
+  1) Arrancar el servidor apuntando al stub:
+       ESP32_IP=127.0.0.1:8081 uvicorn main:app --port 8000
+  2) Lanzar la carga (uno o varios niveles "dispositivosxvisores"):
+       python carga.py --niveles 1x1,5x10,10x50 --duracion 30 --imagenes ./caras
+=====================================================
+"""
+
+# =====================================================
+# LIBRERÍAS
+# =====================================================
+import argparse
+import asyncio
+import itertools
+import os
+import time
+
+import cv2
+import httpx
+import numpy as np
+import uvicorn
+import websockets
+from fastapi import FastAPI, Form
+
+# =====================================================
+# STUB DEL ESP32 (/send-command)
+# =====================================================
+stub_app = FastAPI()
+stub_commands = []
+
+@stub_app.post("/send-command")
+async def stub_send_command(cmd: str = Form(...)):
+    """Responde como el firmware del ESP32 y cuenta los comandos recibidos."""
+    stub_commands.append(cmd)
+    return {"status": "ok", "cmd": cmd}
+
+async def start_stub(port: int):
+    server = uvicorn.Server(uvicorn.Config(stub_app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, task
+
+# =====================================================
+# FRAMES DE PRUEBA
+# =====================================================
+def load_frames(image_dir: str = None, count: int = 20, size=(320, 240)):
+    """Carga JPEGs de un directorio o genera frames sintéticos distintos."""
+    if image_dir:
+        frames = []
+        for filename in sorted(os.listdir(image_dir)):
+            if filename.lower().endswith((".jpg", ".jpeg")):
+                with open(os.path.join(image_dir, filename), "rb") as f:
+                    frames.append(f.read())
+        if frames:
+            return frames
+
+    frames = []
+    width, height = size
+    for i in range(count):
+        img = np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)
+        cv2.putText(img, f"frame {i}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        frames.append(cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes())
+    return frames
+
+_body_counter = itertools.count()
+
+def unique_body(frame: bytes) -> bytes:
+    """
+    Hace único el cuerpo de /upload-image para que no acierte en la caché por
+    hash del servidor: se añade un contador tras el marcador de fin del JPEG,
+    que el decodificador ignora, así la imagen decodificada es la misma.
+    """
+    return frame + next(_body_counter).to_bytes(8, "little")
+
+# =====================================================
+# MÉTRICAS
+# =====================================================
+class Stats:
+    """Latencias y errores por operación, frames enviados y recibidos por cliente."""
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.frames_sent = {}
+        self.frames_received = {}
+
+    def record(self, operation: str, latency_ms: float, ok: bool):
+        self.latencies.setdefault(operation, []).append(latency_ms)
+        if not ok:
+            self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    async def timed_post(self, client: httpx.AsyncClient, operation: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.post(url, **kwargs)
+            ok = response.status_code < 400
+        except Exception:
+            ok = False
+        self.record(operation, (time.perf_counter() - start) * 1000, ok)
+
+    def report(self, duration: float, devices: int, viewers: int):
+        print(f"\n===== NIVEL {devices} dispositivos x {viewers} visores ({duration:.0f} s) =====")
+        print(f"{'operación':<22}{'peticiones':>11}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errores':>9}")
+        for operation, values in sorted(self.latencies.items()):
+            errors = self.errors.get(operation, 0)
+            print(f"{operation:<22}{len(values):>11}{len(values) / duration:>9.1f}"
+                  f"{np.percentile(values, 50):>9.1f}{np.percentile(values, 99):>9.1f}"
+                  f"{errors / len(values):>8.1%}")
+
+        sent = sum(self.frames_sent.values())
+        print(f"\nFrames enviados por WebSocket: {sent} ({sent / duration:.1f} fps en total)")
+        if self.frames_received:
+            fps = [count / duration for count in self.frames_received.values()]
+            print(f"FPS por visor: min {min(fps):.1f} / media {np.mean(fps):.1f} / max {max(fps):.1f}")
+        print(f"Comandos recibidos por el stub ESP32: {len(stub_commands)}")
+
+# =====================================================
+# CLIENTES SIMULADOS
+# =====================================================
+async def periodic(rate: float, deadline: float, action):
+    """Ejecuta action() rate veces por segundo hasta deadline."""
+    if rate <= 0:
+        return
+    interval = 1 / rate
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        await action()
+        await asyncio.sleep(max(0, interval - (time.monotonic() - start)))
+
+async def run_device(device_id: int, args, frames, stats: Stats, deadline: float):
+    """ESP32 simulado: stream por WebSocket y peticiones HTTP en paralelo."""
+    ws_url = args.servidor.replace("http", "ws", 1) + "/ws/stream"
+    counter = {"i": device_id}
+
+    def next_frame():
+        counter["i"] += 1
+        return frames[counter["i"] % len(frames)]
+
+    async def stream():
+        try:
+            async with websockets.connect(ws_url, max_size=None) as ws:
+                # El servidor reenvía a todos los demás clientes: hay que vaciar la cola
+                drain = asyncio.create_task(_drain(ws))
+
+                async def send_frame():
+                    await ws.send(next_frame())
+                    stats.frames_sent[device_id] = stats.frames_sent.get(device_id, 0) + 1
+
+                await periodic(args.fps, deadline, send_frame)
+                drain.cancel()
+        except Exception as e:
+            stats.record("ws/stream (conexión)", 0, False)
+            print(f"[ESP32 {device_id}] Error en WebSocket: {e}")
+
+    async with httpx.AsyncClient(base_url=args.servidor, timeout=30) as client:
+        async def upload_image():
+            # Con --cache se reenvían los mismos bytes para medir los aciertos de caché
+            body = next_frame() if args.cache else unique_body(next_frame())
+            await stats.timed_post(client, "upload-image", "/upload-image",
+                                   params={"modo": "recognize"}, content=body)
+
+        async def recognition_result():
+            await stats.timed_post(client, "recognition-result", "/recognition-result/",
+                                   json={"status": "success", "message": f"carga-{device_id}",
+                                         "face_id": -1})
+
+        await asyncio.gather(
+            stream(),
+            periodic(args.imagenes_por_segundo, deadline, upload_image),
+            periodic(args.resultados_por_segundo, deadline, recognition_result),
+        )
+
+async def _drain(ws):
+    try:
+        async for _ in ws:
+            pass
+    except Exception:
+        pass
+
+async def run_viewer(viewer_id: int, args, stats: Stats, deadline: float):
+    """Visor móvil simulado: cuenta los frames recibidos del stream."""
+    ws_url = (args.servidor.replace("http", "ws", 1)
+              + f"/ws/stream?tier={args.nivel_visor}&max_fps={args.max_fps_visor}")
+    stats.frames_received[viewer_id] = 0
+    try:
+        async with websockets.connect(ws_url, max_size=None) as ws:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    message = await asyncio.wait_for(ws.recv(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if isinstance(message, bytes):
+                    stats.frames_received[viewer_id] += 1
+    except Exception as e:
+        stats.record("ws/stream (conexión)", 0, False)
+        print(f"[VISOR {viewer_id}] Error en WebSocket: {e}")
+
+async def run_commands(args, stats: Stats, deadline: float):
+    """App simulada enviando comandos que el servidor reenvía al stub del ESP32."""
+    async with httpx.AsyncClient(base_url=args.servidor, timeout=30) as client:
+        async def send_command():
+            await stats.timed_post(client, "send-command", "/send-command", data={"cmd": "stream"})
+
+        await periodic(args.comandos_por_segundo, deadline, send_command)
+
+# =====================================================
+# EJECUCIÓN
+# =====================================================
+async def run_level(devices: int, viewers: int, args, frames):
+    stats = Stats()
+    stub_commands.clear()
+    deadline = time.monotonic() + args.duracion
+
+    # Los visores se conectan primero para no perder los primeros frames
+    viewer_tasks = [asyncio.create_task(run_viewer(i, args, stats, deadline)) for i in range(viewers)]
+    await asyncio.sleep(0.5)
+    await asyncio.gather(
+        *(run_device(i, args, frames, stats, deadline) for i in range(devices)),
+        run_commands(args, stats, deadline),
+    )
+    await asyncio.gather(*viewer_tasks)
+    stats.report(args.duracion, devices, viewers)
+
+def parse_levels(levels: str):
+    """Convierte "1x1,5x10" en [(1, 1), (5, 10)]."""
+    result = []
+    for level in levels.split(","):
+        devices, viewers = level.lower().split("x")
+        result.append((int(devices), int(viewers)))
+    return result
+
+async def main(args):
+    if not args.imagenes:
+        print("AVISO: sin --imagenes se usan frames sintéticos sin caras; /upload-image "
+              "solo medirá el detector (NO FACE DETECTED), no el reconocimiento.")
+    if args.cache:
+        print("AVISO: --cache reenvía cuerpos idénticos; /upload-image medirá sobre todo "
+              "aciertos de la caché del servidor, no la inferencia.")
+    frames = load_frames(args.imagenes)
+    server, task = await start_stub(args.stub_puerto)
+    print(f"Stub ESP32 escuchando en 127.0.0.1:{args.stub_puerto} "
+          f"(arrancar el servidor con ESP32_IP=127.0.0.1:{args.stub_puerto})")
+    try:
+        for devices, viewers in parse_levels(args.niveles):
+            await run_level(devices, viewers, args, frames)
+    finally:
+        server.should_exit = True
+        await task
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generador de carga para el servidor FastAPI.")
+    parser.add_argument("--servidor", default="http://127.0.0.1:8000")
+    parser.add_argument("--niveles", default="1x1", help="Niveles de carga dispositivosxvisores, p. ej. 1x1,5x10")
+    parser.add_argument("--duracion", type=float, default=30, help="Segundos por nivel")
+    parser.add_argument("--fps", type=float, default=10, help="Frames por segundo por ESP32 en /ws/stream")
+    parser.add_argument("--imagenes-por-segundo", type=float, default=1, help="/upload-image por ESP32")
+    parser.add_argument("--resultados-por-segundo", type=float, default=1, help="/recognition-result/ por ESP32")
+    parser.add_argument("--comandos-por-segundo", type=float, default=0.5, help="/send-command en total")
+    parser.add_argument("--nivel-visor", default="original", help="Nivel de calidad de los visores (original, media, baja)")
+    parser.add_argument("--max-fps-visor", type=float, default=0, help="Límite de FPS por visor (0 = sin límite)")
+    parser.add_argument("--imagenes", help="Directorio con JPEGs con caras (por defecto frames sintéticos sin caras)")
+    parser.add_argument("--cache", action="store_true",
+                        help="Reenviar imágenes idénticas para medir la caché (por defecto cada cuerpo es único)")
+    parser.add_argument("--stub-puerto", type=int, default=8081)
+    asyncio.run(main(parser.parse_args()))
@@ -16,11 +16,13 @@ Descripción:
 # LIBRERÍAS
 # =====================================================
 from fastapi import FastAPI, HTTPException, Request, Query, WebSocket
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import Form
 from pydantic import BaseModel
 from typing import Optional, List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
 import httpx
 import sqlite3
@@ -29,10 +31,17 @@ import cv2
 import os
 import pickle
 import json
+import csv
+import io
 import datetime
+import hashlib
+import threading
+import time
 import traceback
 
-from insightface.app import FaceAnalysis
+from insightface.utils import face_align
+
+from modelos import MODEL_MODES, build_face_analysis
 
 # =====================================================
 # CONFIGURACIÓN FASTAPI Y CORS
@@ -50,9 +59,48 @@ app.add_middleware(
 # =====================================================
 # BASE DE DATOS SQLITE
 # =====================================================
+DB_PATH = "accesos.db"
+RESULT_FIELDS = ["id", "status", "message", "face_id", "timestamp", "origin",
+                 "first_seen", "last_seen", "frame_count", "best_score"]
+RESULT_COLUMNS = ", ".join(RESULT_FIELDS)
+
+# Columnas de eventos agrupados (añadidas a bases de datos antiguas al arrancar)
+EVENT_COLUMNS = {
+    "first_seen": "TIMESTAMP",
+    "last_seen": "TIMESTAMP",
+    "frame_count": "INTEGER DEFAULT 1",
+    "best_score": "REAL",
+}
+
+# Retención: la tabla principal solo guarda los últimos RETENTION_DAYS días.
+# Los registros más antiguos se mueven a un fichero SQLite por mes en ARCHIVE_DIR.
+RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", "90"))   # 0 = sin archivado
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archivo")
+ARCHIVE_INTERVAL_SECONDS = int(os.environ.get("ARCHIVE_INTERVAL_SECONDS", "3600"))
+ARCHIVE_BATCH_SIZE = 500
+# Exclusión entre el archivado, el borrado total y la reconstrucción de rollups:
+# si una fila se moviera entre la lectura del archivo y la de la tabla principal
+# no se contaría, y si se borrara se volvería a contar.
+archive_lock = threading.Lock()
+EXPORT_CHUNK_SIZE = 1000
+
+def get_connection(path: str = DB_PATH):
+    """Abre una conexión SQLite en modo WAL (lecturas y archivado no bloquean inserciones)."""
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def add_event_columns(conn, schema: str = "main"):
+    """Añade las columnas de eventos que falten en una tabla de resultados existente."""
+    existing = {row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(recognition_results)")}
+    for column, column_type in EVENT_COLUMNS.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {schema}.recognition_results ADD COLUMN {column} {column_type}")
+
 def create_table():
     """Crea la tabla de resultados de reconocimiento (si no existe)."""
-    conn = sqlite3.connect('accesos.db')
+    conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute('''
@@ -65,43 +113,437 @@ def create_table():
             origin TEXT DEFAULT 'SERVER'
         )
     ''')
+    add_event_columns(conn)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recognition_results_timestamp
+        ON recognition_results (timestamp)
+    ''')
+    # Rollups por hora x origen x estado x identidad para la analítica
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS access_rollups (
+            bucket TEXT NOT NULL,
+            origin TEXT NOT NULL,
+            status TEXT NOT NULL,
+            identity TEXT NOT NULL,
+            events INTEGER NOT NULL DEFAULT 0,
+            frames INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, origin, status, identity)
+        ) WITHOUT ROWID
+    ''')
     conn.commit()
     conn.close()
 
 create_table()
 
-def insert_result(status: str, message: str, face_id: int, origin: str = "SERVER"):
-    conn = sqlite3.connect('accesos.db')
+ROLLUP_KEY = (
+    "strftime('%Y-%m-%d %H:00:00', timestamp), COALESCE(origin, ''), "
+    "COALESCE(status, ''), COALESCE(message, '')"
+)
+ROLLUP_UPSERT = '''
+    INSERT INTO access_rollups (bucket, origin, status, identity, events, frames)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (bucket, origin, status, identity)
+    DO UPDATE SET events = events + excluded.events, frames = frames + excluded.frames
+'''
+
+def get_rollup_key(conn, result_id: int):
+    """Devuelve (bucket, origin, status, identity, frames) de un resultado, o None."""
+    return conn.execute(
+        f"SELECT {ROLLUP_KEY}, COALESCE(frame_count, 1) FROM recognition_results WHERE id = ?",
+        (result_id,)).fetchone()
+
+def subtract_from_rollups(conn, key):
+    """Descuenta de los rollups un resultado que se va a borrar."""
+    conn.execute('''
+        UPDATE access_rollups SET events = events - 1, frames = frames - ?
+        WHERE bucket = ? AND origin = ? AND status = ? AND identity = ?
+    ''', (key[4], *key[:4]))
+    conn.execute("DELETE FROM access_rollups WHERE events <= 0")
+
+def insert_result(status: str, message: str, face_id: int, origin: str = "SERVER",
+                  seen_at: Optional[str] = None, score: Optional[float] = None) -> int:
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute('''
-        INSERT INTO recognition_results (status, message, face_id, origin) 
-        VALUES (?, ?, ?, ?)
-    ''', (status, message, face_id, origin))
+        INSERT INTO recognition_results (status, message, face_id, origin, first_seen, last_seen, best_score) 
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (status, message, face_id, origin, seen_at, seen_at, score))
+    row_id = cursor.lastrowid
+    # Rollup actualizado en la misma transacción que la inserción
+    key = get_rollup_key(conn, row_id)
+    cursor.execute(ROLLUP_UPSERT, (*key[:4], 1, key[4]))
+    conn.commit()
+    conn.close()
+    return row_id
+
+def update_result_event(result_id: int, last_seen: str, frame_count: int,
+                        best_score: Optional[float]):
+    """Cierra un evento agrupado con su último instante, nº de frames y mejor score."""
+    conn = get_connection()
+    key = get_rollup_key(conn, result_id)
+    conn.execute('''
+        UPDATE recognition_results SET last_seen = ?, frame_count = ?, best_score = ?
+        WHERE id = ?
+    ''', (last_seen, frame_count, best_score, result_id))
+    if key:
+        conn.execute(ROLLUP_UPSERT, (*key[:4], 0, frame_count - key[4]))
     conn.commit()
     conn.close()
 
-def get_results():
-    conn = sqlite3.connect('accesos.db')
+def get_results(include_archived: bool = False, month: Optional[str] = None):
+    """
+    Devuelve los resultados de la tabla principal.
+    Con include_archived también los meses archivados; con month ("YYYY-MM")
+    solo ese mes (archivado o no).
+    """
+    rows = []
+    if include_archived or month:
+        for archived_month in list_archived_months():
+            if month and archived_month != month:
+                continue
+            conn = sqlite3.connect(archive_path(archived_month))
+            rows.extend(conn.execute(
+                f"SELECT {RESULT_COLUMNS} FROM recognition_results ORDER BY id").fetchall())
+            conn.close()
+
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM recognition_results")
-    rows = cursor.fetchall()
+    if month:
+        cursor.execute(f"SELECT {RESULT_COLUMNS} FROM recognition_results "
+                       "WHERE strftime('%Y-%m', timestamp) = ?", (month,))
+    else:
+        cursor.execute(f"SELECT {RESULT_COLUMNS} FROM recognition_results")
+    rows.extend(cursor.fetchall())
     conn.close()
     return rows
 
+async def iter_results(since: Optional[str] = None, until: Optional[str] = None,
+                       origin: Optional[str] = None, include_archived: bool = False):
+    """
+    Recorre los resultados en orden cronológico leyendo del cursor por bloques,
+    sin cargar la tabla en memoria. Cada conexión lee una instantánea WAL,
+    así que la exportación no bloquea las inserciones concurrentes.
+    Toda la E/S de SQLite se hace en un único hilo propio de la exportación,
+    porque una conexión sqlite3 solo puede usarse desde el hilo que la creó.
+    """
+    conditions, params = [], []
+    if since:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        conditions.append("timestamp < ?")
+        params.append(until)
+    if origin:
+        conditions.append("origin = ?")
+        params.append(origin)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"SELECT {RESULT_COLUMNS} FROM recognition_results {where} ORDER BY timestamp, id"
+
+    sources = []
+    if include_archived:
+        for archived_month in list_archived_months():
+            if since and archived_month < since[:7]:
+                continue
+            if until and archived_month > until[:7]:
+                continue
+            sources.append(archive_path(archived_month))
+    sources.append(DB_PATH)
+
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export")
+    try:
+        for path in sources:
+            conn = await loop.run_in_executor(executor, get_connection, path)
+            try:
+                cursor = await loop.run_in_executor(executor, conn.execute, query, params)
+                while True:
+                    rows = await loop.run_in_executor(executor, cursor.fetchmany, EXPORT_CHUNK_SIZE)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                # Sin await: si el cliente se desconecta el cierre se encola igualmente
+                executor.submit(conn.close)
+    finally:
+        executor.shutdown(wait=False)
+
 def delete_all_results():
-    conn = sqlite3.connect('accesos.db')
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM recognition_results")
-    conn.commit()
-    conn.close()
+    # Bajo archive_lock: una reconstrucción concurrente podría leer un archivo
+    # justo antes de borrarlo y reescribir los rollups ya vaciados
+    with archive_lock:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM recognition_results")
+        cursor.execute("DELETE FROM access_rollups")
+        conn.commit()
+        conn.close()
+
+        for archived_month in list_archived_months():
+            os.remove(archive_path(archived_month))
 
 def delete_result_by_id(result_id: int):
-    conn = sqlite3.connect('accesos.db')
+    conn = get_connection()
     cursor = conn.cursor()
+    key = get_rollup_key(conn, result_id)
     cursor.execute("DELETE FROM recognition_results WHERE id = ?", (result_id,))
+    if key:
+        subtract_from_rollups(conn, key)
     conn.commit()
+
+    # Si ya no está en la tabla principal puede estar archivado
+    if not key:
+        for archived_month in list_archived_months():
+            archive = sqlite3.connect(archive_path(archived_month))
+            key = get_rollup_key(archive, result_id)
+            if key:
+                archive.execute("DELETE FROM recognition_results WHERE id = ?", (result_id,))
+                archive.commit()
+                subtract_from_rollups(conn, key)
+                conn.commit()
+            archive.close()
+            if key:
+                break
     conn.close()
 
+# =====================================================
+# RETENCIÓN Y ARCHIVADO MENSUAL
+# =====================================================
+def archive_path(month: str) -> str:
+    """Ruta del fichero de archivo de un mes ("YYYY-MM")."""
+    return os.path.join(ARCHIVE_DIR, f"accesos_{month}.db")
+
+def list_archived_months() -> List[str]:
+    """Meses archivados disponibles, ordenados cronológicamente."""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    return sorted(
+        name[len("accesos_"):-len(".db")]
+        for name in os.listdir(ARCHIVE_DIR)
+        if name.startswith("accesos_") and name.endswith(".db")
+    )
+
+def _archive_month_rows(conn, month: str, ids: List[int]):
+    """Copia un lote de filas a la base de datos del mes y las borra de la principal."""
+    conn.execute("ATTACH DATABASE ? AS archivo", (archive_path(month),))
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS archivo.recognition_results (
+                id INTEGER PRIMARY KEY,
+                status TEXT,
+                message TEXT,
+                face_id INTEGER,
+                timestamp TIMESTAMP,
+                origin TEXT,
+                first_seen TIMESTAMP,
+                last_seen TIMESTAMP,
+                frame_count INTEGER DEFAULT 1,
+                best_score REAL
+            )
+        ''')
+        add_event_columns(conn, "archivo")
+        placeholders = ",".join("?" * len(ids))
+        # INSERT OR IGNORE hace la operación idempotente: si el proceso se corta
+        # entre la copia y el borrado, el siguiente ciclo simplemente termina el trabajo.
+        conn.execute(f'''
+            INSERT OR IGNORE INTO archivo.recognition_results ({RESULT_COLUMNS})
+            SELECT {RESULT_COLUMNS} FROM main.recognition_results WHERE id IN ({placeholders})
+        ''', ids)
+        conn.execute(f"DELETE FROM main.recognition_results WHERE id IN ({placeholders})", ids)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("DETACH DATABASE archivo")
+
+def archive_old_results(retention_days: int = RETENTION_DAYS) -> int:
+    """
+    Mueve a los ficheros mensuales los registros con más de retention_days días.
+    Trabaja en lotes pequeños para que cada transacción sea corta y no bloquee
+    las inserciones. Devuelve el número de registros archivados.
+    """
+    if retention_days <= 0:
+        return 0
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+
+    with archive_lock:
+        return _archive_old_results(retention_days)
+
+def _archive_old_results(retention_days: int) -> int:
+    conn = get_connection()
+    moved = 0
+    try:
+        while True:
+            rows = conn.execute('''
+                SELECT id, strftime('%Y-%m', timestamp) FROM recognition_results
+                WHERE timestamp < datetime('now', ?)
+                ORDER BY timestamp LIMIT ?
+            ''', (f"-{retention_days} days", ARCHIVE_BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+
+            by_month = {}
+            for row_id, month in rows:
+                by_month.setdefault(month, []).append(row_id)
+            for month, ids in by_month.items():
+                _archive_month_rows(conn, month, ids)
+            moved += len(rows)
+    finally:
+        conn.close()
+    return moved
+
+def upgrade_archives():
+    """Añade las columnas de eventos a los meses archivados con el esquema antiguo."""
+    for archived_month in list_archived_months():
+        conn = sqlite3.connect(archive_path(archived_month))
+        add_event_columns(conn)
+        conn.commit()
+        conn.close()
+
+upgrade_archives()
+
+# =====================================================
+# ANALÍTICA – ROLLUPS INCREMENTALES
+# =====================================================
+def rebuild_rollups():
+    """Recalcula los rollups desde cero a partir de la tabla principal y el archivo."""
+    aggregate = (f"SELECT {ROLLUP_KEY}, COUNT(*), SUM(COALESCE(frame_count, 1)) "
+                 "FROM recognition_results GROUP BY 1, 2, 3, 4")
+
+    with archive_lock:
+        archived = []
+        for archived_month in list_archived_months():
+            archive = sqlite3.connect(archive_path(archived_month))
+            archived.extend(archive.execute(aggregate).fetchall())
+            archive.close()
+
+        conn = get_connection()
+        try:
+            conn.execute("DELETE FROM access_rollups")
+            conn.executemany(ROLLUP_UPSERT, conn.execute(aggregate).fetchall() + archived)
+            conn.commit()
+        finally:
+            conn.close()
+
+def backfill_rollups():
+    """Rellena los rollups al arrancar si la tabla es nueva y ya hay resultados."""
+    conn = get_connection()
+    has_rollups = conn.execute("SELECT 1 FROM access_rollups LIMIT 1").fetchone()
+    has_results = conn.execute("SELECT 1 FROM recognition_results LIMIT 1").fetchone()
+    conn.close()
+    if not has_rollups and (has_results or list_archived_months()):
+        rebuild_rollups()
+
+backfill_rollups()
+
+async def archive_loop():
+    """Tarea en segundo plano: archiva periódicamente fuera del event loop."""
+    while True:
+        try:
+            moved = await asyncio.to_thread(archive_old_results)
+            if moved:
+                print(f"[ARCHIVO] {moved} registros movidos a {ARCHIVE_DIR}/")
+        except Exception as e:
+            print(f"[ARCHIVO] Error archivando resultados: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_archive_task():
+    if RETENTION_DAYS > 0:
+        asyncio.create_task(archive_loop())
+
+# =====================================================
+# AGRUPACIÓN DE EVENTOS DE ACCESO
+# =====================================================
+# Frames consecutivos de la misma persona en el mismo dispositivo se guardan
+# como un único evento (primer/último instante, nº de frames y mejor score).
+COALESCE_WINDOW_SECONDS = float(os.environ.get("COALESCE_WINDOW_SECONDS", "5"))   # 0 = sin agrupar
+
+def _utc_timestamp(seconds: float) -> str:
+    """Mismo formato que CURRENT_TIMESTAMP de SQLite, con milisegundos."""
+    value = datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+class AccessCoalescer:
+    """
+    Agrupa los resultados por (status, identidad, origen, dispositivo).
+    El primer frame se inserta en el momento, así el acceso queda registrado
+    sin retraso; al cerrarse la ventana se actualiza esa misma fila.
+    """
+    def __init__(self, window: float = COALESCE_WINDOW_SECONDS):
+        self.window = window
+        self.events = {}
+        self.lock = threading.Lock()
+
+    async def record(self, status: str, identity: str, face_id: int = -1, origin: str = "SERVER",
+                     device: str = "", score: Optional[float] = None):
+        # El lock solo protege el diccionario; la E/S de SQLite va siempre fuera
+        # de él y en un hilo, para no bloquear el event loop.
+        now = time.time()
+        if self.window <= 0:
+            await asyncio.to_thread(insert_result, status, identity, face_id, origin,
+                                    _utc_timestamp(now), score)
+            return
+
+        key = (status, identity, origin, device)
+        with self.lock:
+            event = self.events.get(key)
+            if event and now - event["last_seen"] <= self.window:
+                event["last_seen"] = now
+                event["frames"] += 1
+                if score is not None and (event["best_score"] is None or score > event["best_score"]):
+                    event["best_score"] = score
+                return
+
+            expired = event
+            event = {"id": None, "last_seen": now, "frames": 1, "best_score": score}
+            self.events[key] = event
+
+        if expired:
+            await asyncio.to_thread(self._close, expired)
+        event["id"] = await asyncio.to_thread(insert_result, status, identity, face_id, origin,
+                                              _utc_timestamp(now), score)
+
+    def _close(self, event):
+        # Si solo hubo un frame la fila insertada ya es definitiva
+        if event["frames"] > 1 and event["id"] is not None:
+            update_result_event(event["id"], _utc_timestamp(event["last_seen"]),
+                                event["frames"], event["best_score"])
+
+    def flush(self, force: bool = False):
+        """Cierra los eventos inactivos más de una ventana (o todos con force)."""
+        now = time.time()
+        closing = []
+        with self.lock:
+            for key, event in list(self.events.items()):
+                if event["id"] is None:
+                    continue   # Su inserción aún no ha terminado
+                if force or now - event["last_seen"] > self.window:
+                    closing.append(self.events.pop(key))
+
+        for event in closing:
+            self._close(event)
+
+access_events = AccessCoalescer()
+
+async def coalesce_loop():
+    """Tarea en segundo plano que cierra los eventos cuya ventana ha expirado."""
+    while True:
+        await asyncio.sleep(max(access_events.window, 1))
+        try:
+            await asyncio.to_thread(access_events.flush)
+        except Exception as e:
+            print(f"[EVENTOS] Error cerrando eventos: {e}")
+
+@app.on_event("startup")
+async def start_coalesce_task():
+    if access_events.window > 0:
+        asyncio.create_task(coalesce_loop())
+
+@app.on_event("shutdown")
+def flush_access_events():
+    access_events.flush(force=True)
+
 # =====================================================
 # MODELOS Pydantic
 # =====================================================
@@ -117,26 +559,146 @@ class EmbeddingData(BaseModel):
 # =====================================================
 # ENDPOINTS – RESULTADOS DE RECONOCIMIENTO
 # =====================================================
+def row_to_dict(row):
+    return dict(zip(RESULT_FIELDS, row))
+
 @app.post("/recognition-result/")
-async def recognition_result(result: FaceRecognitionResult):
+async def recognition_result(result: FaceRecognitionResult, request: Request):
     """Recibe y guarda un resultado de reconocimiento (origen ESP32)."""
-    insert_result(result.status, result.message, result.face_id, origin="ESP32")
+    await access_events.record(result.status, result.message, result.face_id,
+                               origin="ESP32", device=request.client.host)
     return {"message": "Result received", "status": "success"}
 
 @app.get("/recognition-result/")
-async def get_all_results():
-    """Devuelve todos los resultados almacenados."""
-    results = get_results()
+async def get_all_results(
+    include_archived: bool = False,
+    month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$")
+):
+    """
+    Devuelve los resultados almacenados (por defecto solo los recientes).
+    include_archived=true añade los meses archivados; month=YYYY-MM consulta un mes concreto.
+    """
+    results = get_results(include_archived, month)
     if not results:
         raise HTTPException(status_code=404, detail="No results found")
 
-    formatted = [
-        {"id": row[0], "status": row[1], "message": row[2],
-         "face_id": row[3], "timestamp": row[4], "origin": row[5]}
-        for row in results
-    ]
+    formatted = [row_to_dict(row) for row in results]
     return {"results": formatted}
 
+@app.get("/recognition-result/archive")
+async def get_archived_months():
+    """Devuelve los meses disponibles en el archivo."""
+    return {"retention_days": RETENTION_DAYS, "months": list_archived_months()}
+
+def _format_timestamp(value: Optional[datetime.datetime]) -> Optional[str]:
+    """Convierte al formato de CURRENT_TIMESTAMP de SQLite para comparar como texto."""
+    return value.strftime("%Y-%m-%d %H:%M:%S") if value else None
+
+async def _export_ndjson(chunks):
+    try:
+        async for rows in chunks:
+            yield "".join(json.dumps(row_to_dict(row)) + "\n" for row in rows)
+    finally:
+        await chunks.aclose()   # Cierra la conexión aunque el cliente se desconecte
+
+async def _export_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(RESULT_FIELDS)
+    try:
+        async for rows in chunks:
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    finally:
+        await chunks.aclose()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@app.get("/recognition-result/export")
+async def export_results(
+    formato: str = Query("ndjson", enum=["ndjson", "csv"]),
+    desde: Optional[datetime.datetime] = None,
+    hasta: Optional[datetime.datetime] = None,
+    origin: Optional[str] = Query(None, enum=["SERVER", "ESP32"]),
+    include_archived: bool = False
+):
+    """
+    Exporta el historial de accesos en streaming (NDJSON o CSV), con filtros
+    por rango de fechas [desde, hasta) y origen. La memoria usada no depende
+    del número de filas.
+    """
+    chunks = iter_results(_format_timestamp(desde), _format_timestamp(hasta),
+                          origin, include_archived)
+    if formato == "csv":
+        body, media_type = _export_csv(chunks), "text/csv"
+    else:
+        body, media_type = _export_ndjson(chunks), "application/x-ndjson"
+
+    filename = f"accesos.{formato}"
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+ANALYTICS_GROUPS = {
+    "hour": "bucket",
+    "day": "substr(bucket, 1, 10)",
+    "month": "substr(bucket, 1, 7)",
+    "origin": "origin",
+    "status": "status",
+    "identity": "identity",
+}
+
+@app.get("/analytics")
+def get_analytics(
+    group_by: str = Query("day", description=f"Lista separada por comas de: {', '.join(ANALYTICS_GROUPS)}"),
+    desde: Optional[datetime.datetime] = None,
+    hasta: Optional[datetime.datetime] = None,
+    origin: Optional[str] = Query(None, enum=["SERVER", "ESP32"]),
+    status: Optional[str] = None
+):
+    """
+    Conteos de accesos (eventos y frames) agrupados por hora/día/mes, origen,
+    estado o identidad. Se consulta la tabla de rollups, con granularidad de hora.
+    """
+    groups = [g.strip() for g in group_by.split(",") if g.strip()]
+    unknown = [g for g in groups if g not in ANALYTICS_GROUPS]
+    if not groups or unknown:
+        raise HTTPException(status_code=400,
+                            detail=f"group_by no válido; opciones: {', '.join(ANALYTICS_GROUPS)}")
+
+    conditions, params = [], []
+    if desde:
+        conditions.append("bucket >= ?")
+        params.append(_format_timestamp(desde))
+    if hasta:
+        conditions.append("bucket < ?")
+        params.append(_format_timestamp(hasta))
+    if origin:
+        conditions.append("origin = ?")
+        params.append(origin)
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    columns = ", ".join(ANALYTICS_GROUPS[g] for g in groups)
+    conn = get_connection()
+    rows = conn.execute(f'''
+        SELECT {columns}, SUM(events), SUM(frames) FROM access_rollups {where}
+        GROUP BY {columns} ORDER BY {columns}
+    ''', params).fetchall()
+    conn.close()
+
+    results = [dict(zip(groups + ["events", "frames"], row)) for row in rows]
+    return {"group_by": groups, "results": results}
+
+@app.post("/analytics/rebuild")
+def rebuild_analytics():
+    """Recalcula los rollups a partir de todos los resultados (incluido el archivo)."""
+    rebuild_rollups()
+    return {"status": "success", "message": "Rollups recalculados"}
+
 @app.delete("/recognition-result/")
 async def delete_all():
     """Elimina todos los resultados almacenados."""
@@ -152,32 +714,89 @@ async def delete_by_id(result_id: int):
 # =====================================================
 # WEBSOCKETS – STREAMING ENTRE CLIENTES
 # =====================================================
-connected_clients = set()
+# Niveles de calidad que puede elegir cada visor al conectarse (?tier=...&max_fps=...).
+# Cada nivel se recodifica una sola vez por frame y se comparte entre sus visores;
+# si nadie está suscrito a un nivel no se recodifica.
+STREAM_TIERS = {
+    "original": None,   # Frame del ESP32 tal cual
+    "media": {"width": 640, "quality": 70},
+    "baja": {"width": 320, "quality": 50},
+}
+
+class StreamSubscriber:
+    """Cliente del WebSocket con su nivel de calidad y límite de FPS."""
+    def __init__(self, websocket: WebSocket, tier: str = "original", max_fps: float = 0):
+        self.websocket = websocket
+        self.tier = tier
+        self.max_fps = max_fps
+        self.last_sent = 0.0
+
+    def wants_frame(self, now: float) -> bool:
+        return self.max_fps <= 0 or now - self.last_sent >= 1 / self.max_fps
+
+connected_clients = {}   # WebSocket -> StreamSubscriber
+
+def transcode_frame(data: bytes, tier: dict) -> bytes:
+    """Reduce el frame al ancho del nivel y lo recodifica con su calidad JPEG."""
+    img = image_bytes_to_bgr(data)
+    if img is None:
+        return data
+
+    h, w = img.shape[:2]
+    if w > tier["width"]:
+        img = cv2.resize(img, (tier["width"], int(h * tier["width"] / w)), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, tier["quality"]])
+    return buffer.tobytes() if ok else data
+
+async def tier_payload(data: bytes, tier: str) -> bytes:
+    """Frame para un nivel; la recodificación se hace fuera del event loop."""
+    if STREAM_TIERS[tier] is None:
+        return data
+    return await asyncio.to_thread(transcode_frame, data, STREAM_TIERS[tier])
+
+async def relay_frame(sender: WebSocket, data: bytes):
+    """Envía un frame a cada visor en su nivel, recodificando solo los niveles necesarios."""
+    now = time.monotonic()
+    targets = {}
+    for client, subscriber in list(connected_clients.items()):
+        if client != sender and subscriber.wants_frame(now):
+            targets.setdefault(subscriber.tier, []).append(subscriber)
+    if not targets:
+        return
+
+    tiers = list(targets)
+    payloads = await asyncio.gather(*(tier_payload(data, tier) for tier in tiers))
+
+    for tier, payload in zip(tiers, payloads):
+        for subscriber in targets[tier]:
+            subscriber.last_sent = now
+            try:
+                await subscriber.websocket.send_bytes(payload)
+            except Exception as e:
+                print(f"Error al enviar a cliente: {e}")
 
 @app.websocket("/ws/stream")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, tier: str = "original", max_fps: float = 0):
     """WebSocket para retransmitir imágenes y mensajes entre clientes."""
+    if tier not in STREAM_TIERS:
+        await websocket.close(code=1008)
+        return
+
     await websocket.accept()
-    connected_clients.add(websocket)
-    print(f"Cliente conectado: {websocket.client.host}")
+    connected_clients[websocket] = StreamSubscriber(websocket, tier, max_fps)
+    print(f"Cliente conectado: {websocket.client.host} (nivel {tier}, max_fps {max_fps or 'sin límite'})")
 
     try:
         while True:
             message = await websocket.receive()
 
             if "bytes" in message:
-                binary_data = message["bytes"]
-                for client in connected_clients:
-                    if client != websocket:
-                        try:
-                            await client.send_bytes(binary_data)
-                        except Exception as e:
-                            print(f"Error al enviar a cliente: {e}")
+                await relay_frame(websocket, message["bytes"])
 
             elif "text" in message:
                 text_data = message["text"]
                 print("Mensaje de texto recibido del ESP32:", text_data)
-                for client in connected_clients:
+                for client in list(connected_clients):
                     if client != websocket:
                         try:
                             await client.send_text(text_data)
@@ -187,14 +806,14 @@ async def websocket_endpoint(websocket: WebSocket):
     except Exception as e:
         print(f"Conexión cerrada o error: {e}")
     finally:
-        connected_clients.discard(websocket)
+        connected_clients.pop(websocket, None)
         if websocket.client_state.name != "DISCONNECTED":
             await websocket.close()
 
 # =====================================================
 # COMANDOS – COMUNICACIÓN CON ESP32
 # =====================================================
-ESP32_IP = "192.168.18.16"
+ESP32_IP = os.environ.get("ESP32_IP", "192.168.18.16")   # Admite "ip:puerto" (p. ej. el stub de carga.py)
 command_log = []
 
 @app.post("/send-command")
@@ -253,8 +872,12 @@ async def send_to_esp32(cmd: str):
 # =====================================================
 # INSIGHTFACE – INICIALIZACIÓN Y FUNCIONES
 # =====================================================
-face = FaceAnalysis(name="buffalo_l", providers=["CPUExecutionProvider"])
-face.prepare(ctx_id=0)
+# Modo de modelo elegido al arrancar: fp32 (original), optimizado o int8
+FACE_MODEL_MODE = os.environ.get("FACE_MODEL_MODE", "fp32")
+if FACE_MODEL_MODE not in MODEL_MODES:
+    raise RuntimeError(f"FACE_MODEL_MODE inválido: {FACE_MODEL_MODE} (opciones: {MODEL_MODES})")
+
+face = build_face_analysis(FACE_MODEL_MODE)
 
 # Embeddings guardados en disco
 db_path = "face_db.pkl"
@@ -275,10 +898,12 @@ else:
 def save_face_db():
     with open(db_path, "wb") as f:
         pickle.dump(face_db, f)
+    invalidate_indexes()
 
 def save_face_db_esp32():
     with open(db_path_esp32, "wb") as f:
         pickle.dump(face_db_esp32, f)
+    invalidate_indexes()
 
 def image_bytes_to_bgr(image_bytes):
     """Convierte bytes de imagen a formato BGR (OpenCV)."""
@@ -291,12 +916,216 @@ def compare_embeddings(embedding1, embedding2):
     embedding2 = embedding2 / np.linalg.norm(embedding2)
     return np.dot(embedding1, embedding2)
 
+# =====================================================
+# ÍNDICE VECTORIZADO DE EMBEDDINGS (1:N)
+# =====================================================
+RECOGNITION_THRESHOLD = 0.6
+ESP32_RECOGNITION_THRESHOLD = 0.55   # Umbral por defecto de ESP-WHO
+BATCH_WINDOW_MS = 5
+MAX_BATCH_SIZE = 64
+
+class EmbeddingIndex:
+    """
+    Matriz de embeddings ya normalizados para buscar el mejor match de muchas
+    consultas con una sola multiplicación. Se reconstruye al cambiar la galería.
+    """
+    def __init__(self, *sources):
+        self.sources = sources   # Funciones que devuelven los diccionarios nombre -> embedding
+        self.names = []
+        self.matrix = None
+
+    def invalidate(self):
+        self.matrix = None
+
+    def _build(self):
+        names, vectors = [], []
+        for source in self.sources:
+            for nombre, emb in source().items():
+                vector = np.asarray(emb, dtype=np.float32).ravel()
+                norm = np.linalg.norm(vector)
+                # Un embedding nulo o corrupto daría scores NaN: se ignora
+                if norm == 0 or not np.isfinite(norm):
+                    print(f"[ÍNDICE] Embedding de '{nombre}' no válido, se ignora")
+                    continue
+                names.append(nombre)
+                vectors.append(vector)
+        self.names = names
+        if vectors:
+            matrix = np.stack(vectors)
+            self.matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        else:
+            self.matrix = np.empty((0, 0), dtype=np.float32)
+
+    def __len__(self):
+        if self.matrix is None:
+            self._build()
+        return len(self.names)
+
+    def search(self, queries):
+        """Devuelve (nombre, score) del mejor match para cada fila de queries."""
+        if self.matrix is None:
+            self._build()
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if not self.names:
+            return [(None, -1.0)] * len(queries)
+
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        scores = queries @ self.matrix.T
+        best = scores.argmax(axis=1)
+        return [(self.names[i], float(scores[row, i])) for row, i in enumerate(best)]
+
+class EmbeddingBatcher:
+    """
+    Agrupa las consultas que llegan de varios dispositivos en una ventana corta
+    y las resuelve juntas contra el índice.
+    """
+    def __init__(self, index: EmbeddingIndex, window_ms: float = BATCH_WINDOW_MS,
+                 max_batch: int = MAX_BATCH_SIZE):
+        self.index = index
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.pending = []
+        self.flush_handle = None
+
+    async def match(self, embedding):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((embedding, future))
+
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+
+        try:
+            results = self.index.search([emb for emb, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+esp32_index = EmbeddingIndex(lambda: face_db_esp32)
+# Los embeddings del servidor (ArcFace) y del ESP32 (ESP-WHO) vienen de modelos
+# distintos; combinarlos solo tiene sentido si la galería se ha enrolado igual.
+esp32_server_index = EmbeddingIndex(lambda: face_db_esp32, lambda: face_db)
+embedding_indexes = [esp32_index, esp32_server_index]
+gallery_version = 0   # Cambia con cada modificación de las galerías
+
+esp32_batcher = EmbeddingBatcher(esp32_index)
+esp32_server_batcher = EmbeddingBatcher(esp32_server_index)
+
+def invalidate_indexes():
+    """Fuerza la reconstrucción de los índices tras cualquier cambio en las galerías."""
+    global gallery_version
+    gallery_version += 1
+    for index in embedding_indexes:
+        index.invalidate()
+
 # =====================================================
 # ENDPOINT – PROCESAMIENTO DE IMAGEN
 # =====================================================
 enroll_buffer = {}
 NUM_EMBEDDINGS_REQUIRED = 3
 
+def find_best_match(embedding):
+    """Devuelve (nombre, score) del rostro del servidor más parecido."""
+    best_match, best_score = None, -1
+    for nombre_registrado, emb_registrado in face_db.items():
+        score = compare_embeddings(embedding, emb_registrado)
+        if score > best_score:
+            best_score, best_match = score, nombre_registrado
+    return best_match, best_score
+
+async def recognition_response(best_match, best_score, device: str):
+    """Registra el resultado de un reconocimiento en servidor y construye la respuesta."""
+    if best_score > RECOGNITION_THRESHOLD:
+        await access_events.record("success", best_match, origin="SERVER",
+                                   device=device, score=float(best_score))
+        return {"status": "success", "type": "recognition",
+                "name": best_match, "score": float(round(best_score, 3)),
+                "message": f"Bienvenido {best_match}"}
+    else:
+        await access_events.record("error", "Unknown face", origin="SERVER",
+                                   device=device, score=float(best_score))
+        return {"status": "error", "type": "recognition",
+                "name": "Unknown", "score": float(round(best_score, 3)),
+                "message": "Unknown face"}
+
+# =====================================================
+# CACHÉ DE IMÁGENES REPETIDAS
+# =====================================================
+# Los reintentos del ESP32 y de la app reenvían a menudo el mismo JPEG.
+# Se guarda el embedding por hash del contenido; el match se reutiliza solo
+# mientras la galería no cambie (gallery_version).
+IMAGE_CACHE_SIZE = int(os.environ.get("IMAGE_CACHE_SIZE", "256"))
+IMAGE_CACHE_TTL_SECONDS = float(os.environ.get("IMAGE_CACHE_TTL_SECONDS", "30"))
+
+class ImageResultCache:
+    """Caché LRU con caducidad por tiempo y contadores de aciertos/fallos."""
+    def __init__(self, max_entries: int = IMAGE_CACHE_SIZE, ttl: float = IMAGE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(contents: bytes) -> bytes:
+        return hashlib.blake2b(contents, digest_size=16).digest()
+
+    def get(self, key: bytes):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None or time.monotonic() - item[0] > self.ttl:
+                if item is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: bytes, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"entries": len(self.entries), "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl, "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+image_cache = ImageResultCache()
+
+@app.get("/cache-stats")
+async def get_cache_stats():
+    """Devuelve el estado de la caché de imágenes."""
+    return image_cache.stats()
+
 @app.post("/upload-image")
 async def upload_image(
     request: Request,
@@ -307,13 +1136,19 @@ async def upload_image(
     contents = await request.body()
     print(f"[{modo.upper()}] Imagen recibida - {len(contents)} bytes")
 
-    img = image_bytes_to_bgr(contents)
-    faces = face.get(img)
+    cache_key = image_cache.key(contents)
+    cached = image_cache.get(cache_key)
+    if cached is None:
+        img = image_bytes_to_bgr(contents)
+        faces = face.get(img)
+        cached = {"embedding": faces[0].embedding if faces else None,
+                  "match": None, "gallery_version": None}
+        image_cache.put(cache_key, cached)
 
-    if not faces:
+    if cached["embedding"] is None:
         return {"status": "error", "message": "NO FACE DETECTED"}
 
-    embedding = faces[0].embedding
+    embedding = cached["embedding"]
 
     # --- Detectar ---
     if modo == "detect":
@@ -324,22 +1159,12 @@ async def upload_image(
         if not face_db:
             return {"status": "error", "type": "recognition", "message": "Database is empty"}
 
-        best_match, best_score = None, -1
-        for nombre_registrado, emb_registrado in face_db.items():
-            score = compare_embeddings(embedding, emb_registrado)
-            if score > best_score:
-                best_score, best_match = score, nombre_registrado
-
-        if best_score > 0.6:
-            insert_result("success", best_match, -1, origin="SERVER")
-            return {"status": "success", "type": "recognition",
-                    "name": best_match, "score": float(round(best_score, 3)),
-                    "message": f"Bienvenido {best_match}"}
-        else:
-            insert_result("error", "Unknown face", -1, origin="SERVER")
-            return {"status": "error", "type": "recognition",
-                    "name": "Unknown", "score": float(round(best_score, 3)),
-                    "message": "Unknown face"}
+        if cached["gallery_version"] != gallery_version:
+            cached["match"] = find_best_match(embedding)
+            cached["gallery_version"] = gallery_version
+        best_match, best_score = cached["match"]
+
+        return await recognition_response(best_match, best_score, request.client.host)
 
     # --- Enrolar ---
     elif modo == "enroll":
@@ -365,6 +1190,73 @@ async def upload_image(
 
     return {"status": "error", "message": "Unhandled mode"}
 
+# =====================================================
+# ENDPOINT – RECONOCIMIENTO DE RECORTES (SIN DETECCIÓN)
+# =====================================================
+ARCFACE_INPUT_SIZE = 112
+CROP_DETECTION_SIZE = (160, 160)   # Entrada reducida del detector para recortes
+CROP_PADDING = 0.25                # Margen añadido para que el detector vea la cara entera
+
+# Orden de puntos que espera norm_crop (el de ESP-WHO es distinto)
+KPS_ORDER = "ojo izquierdo, ojo derecho, nariz, comisura izquierda, comisura derecha"
+
+def parse_landmarks(kps: str):
+    """Convierte "x1,y1,...,x5,y5" en una matriz 5x2 de puntos faciales."""
+    try:
+        values = [float(v) for v in kps.split(",")]
+    except ValueError:
+        values = []
+    if len(values) != 10:
+        raise HTTPException(status_code=400, detail="kps debe tener 10 valores: x1,y1,...,x5,y5")
+    return np.array(values, dtype=np.float32).reshape(5, 2)
+
+def detect_crop_landmarks(crop):
+    """
+    Obtiene los 5 puntos de un recorte con el detector a baja resolución.
+    Devuelve (imagen con margen, puntos en sus coordenadas) o (None, None).
+    """
+    h, w = crop.shape[:2]
+    pad_y, pad_x = int(h * CROP_PADDING), int(w * CROP_PADDING)
+    padded = cv2.copyMakeBorder(crop, pad_y, pad_y, pad_x, pad_x, cv2.BORDER_CONSTANT, value=0)
+
+    _, kpss = face.det_model.detect(padded, input_size=CROP_DETECTION_SIZE, max_num=1)
+    if kpss is None or len(kpss) == 0:
+        return None, None
+    return padded, kpss[0]
+
+@app.post("/upload-face")
+async def upload_face(
+    request: Request,
+    kps: Optional[str] = Query(None, description=f"5 puntos faciales del recorte, x1,y1,...,x5,y5, en orden: {KPS_ORDER}")
+):
+    """
+    Reconoce un recorte de rostro ya detectado (p. ej. por el ESP32) sin pasar
+    el frame completo por el detector: se alinea con norm_crop y se ejecuta
+    ArcFace. Sin kps, los puntos se obtienen con el detector sobre el recorte
+    pequeño, para que el alineado sea el mismo que en /upload-image.
+    Devuelve lo mismo que /upload-image?modo=recognize.
+    """
+    contents = await request.body()
+    print(f"[RECOGNIZE-CROP] Recorte recibido - {len(contents)} bytes")
+
+    landmarks = parse_landmarks(kps) if kps else None
+    crop = image_bytes_to_bgr(contents)
+    if crop is None:
+        raise HTTPException(status_code=400, detail="Imagen no válida")
+
+    if not face_db:
+        return {"status": "error", "type": "recognition", "message": "Database is empty"}
+
+    if landmarks is None:
+        crop, landmarks = detect_crop_landmarks(crop)
+        if landmarks is None:
+            return {"status": "error", "message": "NO FACE DETECTED"}
+
+    aligned = face_align.norm_crop(crop, landmark=landmarks, image_size=ARCFACE_INPUT_SIZE)
+    embedding = face.models["recognition"].get_feat(aligned).flatten()
+    best_match, best_score = find_best_match(embedding)
+    return await recognition_response(best_match, best_score, request.client.host)
+
 # =====================================================
 # ENDPOINTS – GESTIÓN DE EMBEDDINGS ESP32
 # =====================================================
@@ -397,11 +1289,22 @@ async def get_face_names():
     return {"faces": list(face_db_esp32_loaded.keys())}
 
 @app.post("/upload-embedding")
-async def upload_embedding(data: EmbeddingData, modo: str = Query(..., enum=["enroll", "recognize"])):
-    """Recibe embeddings enviados desde ESP32 (enroll y recognize)."""
+async def upload_embedding(
+    data: EmbeddingData,
+    request: Request,
+    modo: str = Query(..., enum=["enroll", "recognize"]),
+    incluir_servidor: bool = False
+):
+    """
+    Recibe embeddings enviados desde ESP32 (enroll y recognize).
+    En recognize se busca el mejor match en face_db_esp32 (y en face_db si incluir_servidor).
+    """
     embedding_list = data.embedding
     if len(embedding_list) != 512:
         raise HTTPException(status_code=400, detail="Embedding length incorrecta")
+    norm = np.linalg.norm(embedding_list)
+    if norm == 0 or not np.isfinite(norm):
+        raise HTTPException(status_code=400, detail="Embedding nulo o no válido")
 
     if modo == "enroll":
         if not data.nombre:
@@ -411,7 +1314,25 @@ async def upload_embedding(data: EmbeddingData, modo: str = Query(..., enum=["en
         save_face_db_esp32()
         return {"status": "success", "message": f"{nombre} registrado"}
 
-    return {"status": "error", "message": "Modo recognize no implementado en servidor"}
+    # --- Reconocer (1:N en servidor) ---
+    batcher = esp32_server_batcher if incluir_servidor else esp32_batcher
+    if not len(batcher.index):
+        return {"status": "error", "type": "recognition", "message": "Database is empty"}
+
+    best_match, best_score = await batcher.match(embedding_list)
+
+    if best_score > ESP32_RECOGNITION_THRESHOLD:
+        await access_events.record("success", best_match, origin="ESP32",
+                                   device=request.client.host, score=best_score)
+        return {"status": "success", "type": "recognition",
+                "name": best_match, "score": round(best_score, 3),
+                "message": f"Bienvenido {best_match}"}
+    else:
+        await access_events.record("error", "Unknown face", origin="ESP32",
+                                   device=request.client.host, score=best_score)
+        return {"status": "error", "type": "recognition",
+                "name": "Unknown", "score": round(best_score, 3),
+                "message": "Unknown face"}
 
 @app.post("/clear-embeddings-esp32")
 async def clear_embeddings():
@@ -0,0 +1,217 @@
+"""
+=====================================================
+Proyecto TFG – Sistema de Control de Acceso Facial
+Modelos InsightFace optimizados para CPU
+Autor: Francisco
+
+Descripción:
+  - Construcción del FaceAnalysis según el modo de modelo elegido al arrancar:
+      * fp32       → modelos buffalo_l originales.
+      * optimizado → copia FP32 con el grafo ONNX ya optimizado.
+      * int8       → copia cuantizada dinámicamente a INT8 + grafo optimizado.
+  - Las copias se generan una sola vez y se guardan junto a los modelos
+    originales (~/.insightface/models/buffalo_l_<modo>).
+  - Verificación de precisión frente a FP32 sobre un conjunto local de imágenes:
+      python modelos.py --imagenes ./imagenes --modo int8
+=====================================================
+"""
+
+# =====================================================
+# LIBRERÍAS
+# =====================================================
+import argparse
+import os
+import pickle
+import time
+
+import cv2
+import numpy as np
+
+from insightface.app import FaceAnalysis
+from insightface.utils import ensure_available
+
+# =====================================================
+# CONFIGURACIÓN
+# =====================================================
+MODEL_NAME = "buffalo_l"
+MODEL_ROOT = os.path.expanduser("~/.insightface")
+MODEL_MODES = ["fp32", "optimizado", "int8"]
+
+# Solo se optimizan los modelos que usa el servidor (detector y ArcFace)
+MODEL_FILES = {
+    "detection": "det_10g.onnx",
+    "recognition": "w600k_r50.onnx",
+}
+
+PROVIDERS = ["CPUExecutionProvider"]
+
+# =====================================================
+# GENERACIÓN DE MODELOS OPTIMIZADOS
+# =====================================================
+def _is_up_to_date(src: str, dst: str) -> bool:
+    """Indica si la copia optimizada existe y es más reciente que el original."""
+    return os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src)
+
+def _optimize_graph(src: str, dst: str):
+    """Guarda una copia del modelo con las optimizaciones de grafo de ONNX Runtime."""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    # EXTENDED es el nivel más alto que se puede serializar de forma portable
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    options.optimized_model_filepath = dst
+    ort.InferenceSession(src, options, providers=PROVIDERS)
+
+def _quantize_int8(src: str, dst: str):
+    """Cuantiza dinámicamente los pesos del modelo a 8 bits."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    # ConvInteger de CPU solo admite pesos sin signo, por eso QUInt8
+    quantize_dynamic(src, dst, weight_type=QuantType.QUInt8)
+
+def prepare_models(mode: str) -> str:
+    """
+    Genera (si no existe ya) la copia de los modelos para el modo indicado.
+    Devuelve el nombre del directorio de modelos a usar por FaceAnalysis.
+    """
+    if mode not in MODEL_MODES:
+        raise ValueError(f"Modo de modelo desconocido: {mode} (opciones: {MODEL_MODES})")
+    if mode == "fp32":
+        return MODEL_NAME
+
+    src_dir = ensure_available("models", MODEL_NAME, root=MODEL_ROOT)
+    name = f"{MODEL_NAME}_{mode}"
+    dst_dir = os.path.join(MODEL_ROOT, "models", name)
+    os.makedirs(dst_dir, exist_ok=True)
+
+    for filename in MODEL_FILES.values():
+        src = os.path.join(src_dir, filename)
+        dst = os.path.join(dst_dir, filename)
+        if _is_up_to_date(src, dst):
+            continue
+
+        print(f"[MODELOS] Generando {mode} para {filename}...")
+        # Los intermedios van en dst_dir con extensión .tmp (FaceAnalysis solo carga
+        # *.onnx) y se renombran al final con os.replace, que es atómico en el mismo
+        # sistema de ficheros: si se corta el proceso nunca queda un .onnx a medias.
+        optimized = dst + ".opt.tmp"
+        quantized = dst + ".int8.tmp"
+        try:
+            if mode == "int8":
+                _quantize_int8(src, quantized)
+                _optimize_graph(quantized, optimized)
+            else:
+                _optimize_graph(src, optimized)
+            os.replace(optimized, dst)
+        finally:
+            for tmp in (optimized, quantized):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+    return name
+
+def build_face_analysis(mode: str = "fp32", only_used_models: bool = False) -> FaceAnalysis:
+    """
+    Crea y prepara el FaceAnalysis para el modo de modelo indicado.
+    En fp32 se cargan todos los modelos de buffalo_l salvo con only_used_models.
+    """
+    name = prepare_models(mode)
+    allowed_modules = list(MODEL_FILES.keys()) if mode != "fp32" or only_used_models else None
+    app = FaceAnalysis(name=name, root=MODEL_ROOT, providers=PROVIDERS,
+                       allowed_modules=allowed_modules)
+    app.prepare(ctx_id=0)
+    print(f"[MODELOS] FaceAnalysis preparado en modo {mode} ({name})")
+    return app
+
+# =====================================================
+# VERIFICACIÓN DE PRECISIÓN FRENTE A FP32
+# =====================================================
+def _normalize(embedding):
+    return embedding / np.linalg.norm(embedding)
+
+def _best_match(embedding, gallery: dict, threshold: float):
+    """Devuelve el nombre reconocido (o "Unknown") igual que el modo recognize."""
+    best_match, best_score = None, -1
+    for nombre, emb in gallery.items():
+        score = float(np.dot(_normalize(embedding), _normalize(np.asarray(emb))))
+        if score > best_score:
+            best_score, best_match = score, nombre
+    return best_match if best_score > threshold else "Unknown"
+
+def _timed_get(app: FaceAnalysis, img):
+    start = time.perf_counter()
+    faces = app.get(img)
+    return faces, (time.perf_counter() - start) * 1000
+
+def verify(image_dir: str, mode: str, gallery_path: str = "face_db.pkl",
+           threshold: float = 0.6) -> dict:
+    """
+    Compara el modo indicado con los modelos FP32 sobre las imágenes de un directorio:
+    similitud coseno de embeddings, coincidencia de decisiones y latencia media.
+    """
+    gallery = {}
+    if os.path.exists(gallery_path):
+        with open(gallery_path, "rb") as f:
+            gallery = pickle.load(f)
+
+    # Misma lista de modelos en ambos lados: la latencia compara solo la optimización
+    reference = build_face_analysis("fp32", only_used_models=True)
+    candidate = build_face_analysis(mode)
+
+    cosines, reference_ms, candidate_ms = [], [], []
+    images = detection_mismatches = decision_matches = decisions = 0
+
+    for filename in sorted(os.listdir(image_dir)):
+        img = cv2.imread(os.path.join(image_dir, filename))
+        if img is None:
+            continue
+        images += 1
+
+        faces_ref, ms_ref = _timed_get(reference, img)
+        faces_cand, ms_cand = _timed_get(candidate, img)
+        reference_ms.append(ms_ref)
+        candidate_ms.append(ms_cand)
+
+        if bool(faces_ref) != bool(faces_cand):
+            detection_mismatches += 1
+            print(f"  {filename}: detección distinta (fp32={len(faces_ref)}, {mode}={len(faces_cand)})")
+            continue
+        if not faces_ref:
+            continue
+
+        emb_ref, emb_cand = faces_ref[0].embedding, faces_cand[0].embedding
+        cosine = float(np.dot(_normalize(emb_ref), _normalize(emb_cand)))
+        cosines.append(cosine)
+
+        if gallery:
+            decisions += 1
+            name_ref = _best_match(emb_ref, gallery, threshold)
+            name_cand = _best_match(emb_cand, gallery, threshold)
+            if name_ref == name_cand:
+                decision_matches += 1
+            else:
+                print(f"  {filename}: decisión distinta (fp32={name_ref}, {mode}={name_cand})")
+
+    return {
+        "mode": mode,
+        "images": images,
+        "detection_mismatches": detection_mismatches,
+        "cosine_mean": float(np.mean(cosines)) if cosines else None,
+        "cosine_min": float(np.min(cosines)) if cosines else None,
+        "decision_agreement": decision_matches / decisions if decisions else None,
+        "latency_ms_fp32": float(np.mean(reference_ms)) if reference_ms else None,
+        f"latency_ms_{mode}": float(np.mean(candidate_ms)) if candidate_ms else None,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verifica la precisión de los modelos optimizados frente a FP32.")
+    parser.add_argument("--imagenes", required=True, help="Directorio con imágenes de prueba")
+    parser.add_argument("--modo", default="int8", choices=MODEL_MODES[1:])
+    parser.add_argument("--galeria", default="face_db.pkl", help="Galería de embeddings del servidor")
+    parser.add_argument("--umbral", type=float, default=0.6, help="Umbral de reconocimiento")
+    args = parser.parse_args()
+
+    report = verify(args.imagenes, args.modo, args.galeria, args.umbral)
+    print("\n===== RESULTADO =====")
+    for key, value in report.items():
+        print(f"{key}: {value}")